@@ -48,10 +48,28 @@ async function initDb() {
                 deanSignedPath TEXT,
                 registrarRemarks TEXT,
                 registrarApprovedDate TEXT,
-                registrarSignedPath TEXT
+                registrarSignedPath TEXT,
+                extractionMethod TEXT,
+                closedAt TEXT,
+
+                -- Optimistic lock, bumped on every write (checked by the MAS engine)
+                version INTEGER NOT NULL DEFAULT 0
             );
         `);
 
+        // Older databases were created without these columns
+        const addedColumns = {
+            version: 'INTEGER NOT NULL DEFAULT 0',
+            extractionMethod: 'TEXT',
+            closedAt: 'TEXT'
+        };
+        const letterColumns = (await db.all('PRAGMA table_info(letters)')).map(col => col.name);
+        for (const [name, definition] of Object.entries(addedColumns)) {
+            if (!letterColumns.includes(name)) {
+                await db.exec(`ALTER TABLE letters ADD COLUMN ${name} ${definition}`);
+            }
+        }
+
         const userCount = await db.get('SELECT COUNT(*) as count FROM users');
         if (userCount.count === 0) {
             console.log('Populating database with initial users...');
@@ -109,7 +127,7 @@ async function insertLetter(db, data) {
 /** Updates the cognitive fields (used by PPA/LCA/Analysis Agents). */
 async function updateLetterCognitiveData(db, id, priorityScore, estimatedTime, classification) {
     await db.run(
-        `UPDATE letters SET priorityScore = ?, estimatedTime = ?, classification = ? WHERE id = ?`,
+        `UPDATE letters SET priorityScore = ?, estimatedTime = ?, classification = ?, version = version + 1 WHERE id = ?`,
         [priorityScore, estimatedTime, classification, id]
     );
 }
@@ -117,7 +135,7 @@ async function updateLetterCognitiveData(db, id, priorityScore, estimatedTime, c
 /** Updates the workflow fields (used by Router Agent). */
 async function updateLetterWorkflow(db, id, stage, status, remarks, approvalDeadline) {
     await db.run(
-        `UPDATE letters SET stage = ?, status = ?, remarks = ?, approvalDeadline = ? WHERE id = ?`,
+        `UPDATE letters SET stage = ?, status = ?, remarks = ?, approvalDeadline = ?, version = version + 1 WHERE id = ?`,
         [stage, status, remarks, approvalDeadline, id]
     );
 }
@@ -130,9 +148,9 @@ async function updateLetterApproval(db, id, role, remarks, signedPath) {
     let params = [remarks, date, signedPath, id];
 
     if (role === 'Dean') {
-        query = `UPDATE letters SET deanRemarks = ?, deanApprovedDate = ?, deanSignedPath = ? WHERE id = ?`;
+        query = `UPDATE letters SET deanRemarks = ?, deanApprovedDate = ?, deanSignedPath = ?, version = version + 1 WHERE id = ?`;
     } else if (role === 'Registrar') {
-        query = `UPDATE letters SET registrarRemarks = ?, registrarApprovedDate = ?, registrarSignedPath = ? WHERE id = ?`;
+        query = `UPDATE letters SET registrarRemarks = ?, registrarApprovedDate = ?, registrarSignedPath = ?, version = version + 1 WHERE id = ?`;
     } 
     // Add other roles like VC or Accounts if they have specific columns
     
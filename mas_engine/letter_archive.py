@@ -0,0 +1,265 @@
+import os
+import gzip
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from upload_store import content_hash, object_path
+
+# --- Hot/Cold Archival of the letters table ---
+# Approved and Rejected letters older than the retention period are moved out
+# of epics.db into a separate SQLite file (epics_archive.db by default) whose
+# 'letters' table has the same columns. The pending query, analysis_agent and
+# the dashboards then only scan the active workload.
+#
+# Reads that need full history (get_letter_by_id in mas_workflow.py, when the
+# letter is not active) attach the archive as 'archive' and use the TEMP VIEW
+# 'all_letters' (main + archive). server.js only reads epics.db, so the clerk
+# analytics (/api/analysis) cover letters that are not archived yet.
+#
+# Configuration (.env):
+#   ARCHIVE_RETENTION_DAYS    days after a letter was closed before it is archived (empty = archiving off)
+#   ARCHIVE_DB_PATH           archive database file (default: epics_archive.db next to epics.db)
+#   ARCHIVE_COMPRESS_UPLOADS  set to 1 to gzip the uploaded files of archived letters
+#                             (files whose bytes other uploads share in the upload store are left as is)
+#
+# Run manually:  python mas_engine/letter_archive.py --retention-days 180 [--dry-run]
+
+load_dotenv()
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(SCRIPT_DIR)
+DEFAULT_MAIN_DB_PATH = os.path.join(PARENT_DIR, 'epics.db')
+
+TERMINAL_STATUSES = ('Approved', 'Rejected')
+FILE_COLUMNS = ('filePath', 'signedFilePath', 'chequeFilePath', 'deanSignedPath', 'registrarSignedPath')
+
+
+def get_archive_path(main_db_path=DEFAULT_MAIN_DB_PATH):
+    """ARCHIVE_DB_PATH if set, otherwise epics_archive.db next to the main database."""
+    return os.getenv('ARCHIVE_DB_PATH') or os.path.join(os.path.dirname(main_db_path), 'epics_archive.db')
+
+def get_retention_days():
+    """Returns the configured retention in days, or None when archiving is disabled."""
+    value = os.getenv('ARCHIVE_RETENTION_DAYS')
+    return int(value) if value else None
+
+def _columns(conn, schema):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(letters)")]
+
+
+def attach_archive(conn, archive_path=None):
+    """
+    Attaches the archive DB (if it exists) as 'archive' and creates the TEMP
+    VIEW 'all_letters'. Without an archive the view is just the hot table, so
+    callers can always query all_letters. Columns the archive does not have
+    yet are read as NULL. Letter ids can repeat across main and archive, so
+    the view carries archiveId (NULL for active rows) to order by.
+    """
+    archive_path = archive_path or get_archive_path()
+    main_columns = _columns(conn, 'main')
+    select_main = f"SELECT {', '.join(main_columns)}, NULL AS archiveId FROM main.letters"
+
+    if os.path.exists(archive_path):
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        archive_columns = set(_columns(conn, 'archive'))
+        select_archive = ", ".join(col if col in archive_columns else f"NULL AS {col}" for col in main_columns)
+        view_sql = f"{select_main} UNION ALL SELECT {select_archive}, archiveId FROM archive.letters"
+    else:
+        view_sql = select_main
+
+    conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS all_letters AS {view_sql}")
+    return conn
+
+
+def _create_archive_table(conn):
+    """
+    Creates archive.letters with the main table's columns, keyed by its own
+    archiveId. server.js reuses letter ids (dept + 4 digits of Date.now()),
+    so 'id' cannot be unique in the archive.
+    """
+    definitions = ["archiveId INTEGER PRIMARY KEY AUTOINCREMENT"]
+    for cid, name, col_type, notnull, default, pk in conn.execute("PRAGMA main.table_info(letters)").fetchall():
+        definition = f"{name} {col_type}"
+        if notnull or pk:
+            definition += " NOT NULL"
+        if default is not None:
+            definition += f" DEFAULT {default}"
+        definitions.append(definition)
+    conn.execute(f"CREATE TABLE archive.letters ({', '.join(definitions)})")
+    conn.execute("CREATE INDEX archive.idx_letters_id ON letters (id)")
+
+
+def _ensure_archive_schema(conn):
+    """Creates archive.letters if needed and adds any columns added to main.letters since."""
+    exists = conn.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'letters'").fetchone()
+    if not exists:
+        _create_archive_table(conn)
+        return
+
+    archive_columns = set(_columns(conn, 'archive'))
+    for cid, name, col_type, notnull, default, pk in conn.execute("PRAGMA main.table_info(letters)").fetchall():
+        if name not in archive_columns:
+            definition = f"{name} {col_type}"
+            if default is not None:
+                definition += f" DEFAULT {default}"
+            conn.execute(f"ALTER TABLE archive.letters ADD COLUMN {definition}")
+
+
+def _closed_at_expression(conn):
+    """
+    SQL for when a letter reached Approved/Rejected: closedAt, set by the
+    router. Letters closed before that column existed fall back to the last
+    approver date, then to the submission date.
+    """
+    main_columns = set(_columns(conn, 'main'))
+    candidates = [col for col in ('closedAt', 'registrarApprovedDate', 'deanApprovedDate') if col in main_columns]
+    return f"COALESCE({', '.join(candidates)}, date)" if candidates else "date"
+
+
+def _absolute_upload_path(relative_path):
+    """server.js stores paths with the OS separator ('uploads\\file-...' on Windows)."""
+    return os.path.join(PARENT_DIR, *relative_path.replace('\\', '/').split('/'))
+
+def _store_object(absolute_path):
+    """The upload store object hard-linked to this upload (see upload_store.py), or None."""
+    store_object = object_path(content_hash(absolute_path), os.path.splitext(absolute_path)[1])
+    if os.path.exists(store_object) and os.path.samefile(store_object, absolute_path):
+        return store_object
+    return None
+
+def _compress_file(relative_path):
+    """
+    Gzips an upload in place. Returns the new relative path, or None if nothing
+    was done. An upload ingested into the upload store is a hard link to its
+    object: the object is removed with it when no other upload links to it,
+    and shared (or symlinked) uploads are skipped since gzip would only add a copy.
+    """
+    if not relative_path or relative_path.endswith('.gz'):
+        return None
+    absolute_path = _absolute_upload_path(relative_path)
+    if not os.path.exists(absolute_path) or os.path.islink(absolute_path):
+        return None
+    store_object = _store_object(absolute_path)
+    if os.stat(absolute_path).st_nlink > (2 if store_object else 1):
+        return None
+    with open(absolute_path, 'rb') as src, gzip.open(absolute_path + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    shutil.copystat(absolute_path, absolute_path + '.gz')
+    if store_object:
+        os.remove(store_object)  # the legacy path still holds the bytes until the row is updated
+    return relative_path + '.gz'
+
+
+def compress_archived_uploads(conn, archive_ids):
+    """
+    Gzips the files of the given archived rows (archive.letters.archiveId).
+    conn is in autocommit mode, so the archive row points at the .gz before
+    the original is removed; a crash part-way leaves at worst an extra file.
+    """
+    compressed = 0
+    for archive_id in archive_ids:
+        row = conn.execute(f"SELECT {', '.join(FILE_COLUMNS)} FROM archive.letters WHERE archiveId = ?", (archive_id,)).fetchone()
+        for column, relative_path in zip(FILE_COLUMNS, row):
+            try:
+                new_path = _compress_file(relative_path)
+            except OSError as e:
+                print(f"   [Archive WARNING] Could not compress {relative_path}: {e}")
+                continue
+            if not new_path:
+                continue
+            conn.execute(f"UPDATE archive.letters SET {column} = ? WHERE archiveId = ?", (new_path, archive_id))
+            os.remove(_absolute_upload_path(relative_path))
+            compressed += 1
+    return compressed
+
+
+def archive_terminal_letters(main_db_path=DEFAULT_MAIN_DB_PATH, retention_days=None, archive_path=None,
+                             compress_uploads=None, batch_size=500, dry_run=False):
+    """
+    Moves Approved/Rejected letters closed more than retention_days ago from
+    main.letters to archive.letters, batch_size rows per transaction so the
+    write lock held against server.js stays short. Returns the number moved.
+    """
+    retention_days = get_retention_days() if retention_days is None else retention_days
+    if retention_days is None:
+        return 0
+    archive_path = archive_path or get_archive_path(main_db_path)
+    if compress_uploads is None:
+        compress_uploads = os.getenv('ARCHIVE_COMPRESS_UPLOADS') == '1'
+
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    placeholders = ', '.join('?' for _ in TERMINAL_STATUSES)
+
+    conn = sqlite3.connect(main_db_path, isolation_level=None)
+    try:
+        due_sql = f"FROM main.letters WHERE status IN ({placeholders}) AND {_closed_at_expression(conn)} < ?"
+        candidates_sql = f"SELECT id {due_sql} LIMIT ?"
+        if dry_run:
+            count = conn.execute(f"SELECT COUNT(*) {due_sql}", (*TERMINAL_STATUSES, cutoff)).fetchone()[0]
+            print(f"[Archive] Dry run: {count} letter(s) closed before {cutoff} would be archived to {archive_path}.")
+            return count
+
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        _ensure_archive_schema(conn)
+        columns = ', '.join(_columns(conn, 'main'))
+        has_letter_texts = conn.execute(
+            "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'letter_texts'").fetchone()
+
+        moved_ids = []
+        archive_ids = []
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [row[0] for row in conn.execute(candidates_sql, (*TERMINAL_STATUSES, cutoff, batch_size))]
+                if not ids:
+                    conn.execute("COMMIT")
+                    break
+                id_list = ', '.join('?' for _ in ids)
+                # Plain INSERT: a reused letter id gets a new archive row, never overwrites history
+                last_archive_id = conn.execute("SELECT COALESCE(MAX(archiveId), 0) FROM archive.letters").fetchone()[0]
+                conn.execute(f"INSERT INTO archive.letters ({columns}) "
+                             f"SELECT {columns} FROM main.letters WHERE id IN ({id_list})", ids)
+                batch_archive_ids = [row[0] for row in conn.execute(
+                    "SELECT archiveId FROM archive.letters WHERE archiveId > ?", (last_archive_id,))]
+                conn.execute(f"DELETE FROM main.letters WHERE id IN ({id_list})", ids)
+                if has_letter_texts:
+                    # Full OCR text is only needed by PPA, which never sees terminal letters
+                    conn.execute(f"DELETE FROM main.letter_texts WHERE letterId IN ({id_list})", ids)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            moved_ids.extend(ids)
+            archive_ids.extend(batch_archive_ids)
+
+        if moved_ids:
+            print(f"[Archive] Moved {len(moved_ids)} letter(s) closed before {cutoff} to {archive_path}.")
+            if compress_uploads:
+                compressed = compress_archived_uploads(conn, archive_ids)
+                print(f"[Archive] Compressed {compressed} uploaded file(s).")
+        return len(moved_ids)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old Approved/Rejected letters into the archive database")
+    parser.add_argument('--retention-days', type=int, default=get_retention_days(),
+                        help="Archive terminal letters dated more than this many days ago (default: ARCHIVE_RETENTION_DAYS)")
+    parser.add_argument('--archive-db', default=None, help="Archive database path (default: ARCHIVE_DB_PATH or epics_archive.db)")
+    parser.add_argument('--compress-uploads', action='store_true', default=None, help="gzip uploaded files of archived letters")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true', help="Only report how many letters would be archived")
+    args = parser.parse_args()
+
+    if args.retention_days is None:
+        print("Error: set --retention-days or ARCHIVE_RETENTION_DAYS.")
+        exit()
+    if not os.path.exists(DEFAULT_MAIN_DB_PATH):
+        print(f"Error: Database not found at {DEFAULT_MAIN_DB_PATH}. Please run 'node server.js' first to create it.")
+        exit()
+
+    archive_terminal_letters(retention_days=args.retention_days, archive_path=args.archive_db,
+                             compress_uploads=args.compress_uploads, batch_size=args.batch_size, dry_run=args.dry_run)
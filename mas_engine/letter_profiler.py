@@ -0,0 +1,153 @@
+import os
+import io
+import re
+import time
+import random
+import shutil
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+
+# --- Opt-in Per-Letter Profiling for mas_workflow.py ---
+# Everything is configured through .env and is OFF by default:
+#   MAS_PROFILE_SAMPLE_RATE  fraction of letters to profile, e.g. 0.05 (default 0)
+#   MAS_PROFILE_SLOW_MS      keep a capture only if app.invoke took longer than this
+#   MAS_PROFILE_LETTER_IDS   comma separated letter ids to always profile, e.g. CSE1234,IT5678
+#   MAS_PROFILE_DIR          output directory (default: mas_engine/profiles)
+#   MAS_PROFILE_KEEP         number of captures to keep before the oldest are deleted (default 20)
+#   MAS_PROFILE_TOP_N        rows in the hotspot / allocation summary (default 25)
+#
+# NOTE: cProfile and tracemalloc cannot be attached after the fact, so when
+# MAS_PROFILE_SLOW_MS is set every letter runs under the profilers and only the
+# slow ones are written to disk. Expect letters to run noticeably slower then.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_DIR = os.path.join(SCRIPT_DIR, 'profiles')
+CAPTURE_DIR_PATTERN = re.compile(r'^\d{8}-\d{6}-\d{6}_.+$')  # <YYYYmmdd-HHMMSS-ffffff>_<letter_id>
+
+
+class LetterProfiler:
+    """Wraps app.invoke with cProfile + tracemalloc when a trigger matches."""
+
+    def __init__(self, sample_rate=0.0, slow_ms=None, letter_ids=(), output_dir=DEFAULT_PROFILE_DIR, keep=20, top_n=25):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.letter_ids = set(letter_ids)
+        self.output_dir = output_dir
+        self.keep = max(1, keep)
+        self.top_n = top_n
+        self.enabled = bool(sample_rate > 0 or slow_ms is not None or self.letter_ids)
+
+    @classmethod
+    def from_env(cls):
+        slow_ms = os.getenv('MAS_PROFILE_SLOW_MS')
+        letter_ids = os.getenv('MAS_PROFILE_LETTER_IDS') or ''
+        return cls(
+            sample_rate=float(os.getenv('MAS_PROFILE_SAMPLE_RATE') or 0),
+            slow_ms=float(slow_ms) if slow_ms else None,
+            letter_ids=[lid.strip() for lid in letter_ids.split(',') if lid.strip()],
+            output_dir=os.getenv('MAS_PROFILE_DIR') or DEFAULT_PROFILE_DIR,
+            keep=int(os.getenv('MAS_PROFILE_KEEP') or 20),
+            top_n=int(os.getenv('MAS_PROFILE_TOP_N') or 25),
+        )
+
+    def describe(self):
+        return (f"sample_rate={self.sample_rate}, slow_ms={self.slow_ms}, "
+                f"letter_ids={sorted(self.letter_ids) or '-'}, dir={self.output_dir}")
+
+    def _trigger(self, letter_id):
+        """Returns why this letter should be captured, or None."""
+        if letter_id in self.letter_ids:
+            return 'letter_id'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'sampled'
+        if self.slow_ms is not None:
+            return 'slow_candidate'
+        return None
+
+    def invoke(self, letter_id, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) (normally app.invoke) and, if a trigger
+        matches, captures CPU and allocation profiles around it.
+        """
+        reason = self._trigger(letter_id)
+        if reason is None:
+            return func(*args, **kwargs)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+
+            if reason == 'slow_candidate' and elapsed_ms < self.slow_ms:
+                pass  # fast enough, discard the capture
+            else:
+                if reason == 'slow_candidate':
+                    reason = f'slow (>{self.slow_ms:.0f} ms)'
+                try:
+                    path = self._write_capture(letter_id, reason, elapsed_ms, peak, profiler, before, after)
+                    print(f"   [Profiler] Letter {letter_id} took {elapsed_ms:.0f} ms. Profile written to {path}")
+                except OSError as e:
+                    print(f"   [Profiler WARNING] Could not write profile for {letter_id}: {e}")
+
+    def _write_capture(self, letter_id, reason, elapsed_ms, peak, profiler, before, after):
+        """Writes cpu.prof, alloc.snapshot and summary.txt, then rotates old captures."""
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        capture_dir = os.path.join(self.output_dir, f"{stamp}_{letter_id}")
+        os.makedirs(capture_dir, exist_ok=True)
+
+        profiler.dump_stats(os.path.join(capture_dir, 'cpu.prof'))
+        after.dump(os.path.join(capture_dir, 'alloc.snapshot'))
+
+        cpu_report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=cpu_report)
+        stats.sort_stats('cumulative').print_stats(self.top_n)
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+        alloc_diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+
+        with open(os.path.join(capture_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"Letter: {letter_id}\n")
+            f.write(f"Trigger: {reason}\n")
+            f.write(f"Captured: {datetime.now().isoformat()}\n")
+            f.write(f"Wall time: {elapsed_ms:.1f} ms\n")
+            f.write(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB\n")
+            f.write(f"\n--- Top {self.top_n} CPU hotspots (cumulative) ---\n")
+            f.write(cpu_report.getvalue())
+            f.write(f"\n--- Top {self.top_n} allocation growth by line ---\n")
+            for stat in alloc_diff[:self.top_n]:
+                f.write(f"{stat}\n")
+
+        self._rotate(current=os.path.basename(capture_dir))
+        return capture_dir
+
+    def _rotate(self, current):
+        """
+        Deletes the oldest captures so at most `keep` remain. Only directories
+        named like a capture are touched (MAS_PROFILE_DIR may be a shared
+        folder), and the capture just written is never deleted.
+        """
+        captures = sorted(
+            entry for entry in os.listdir(self.output_dir)
+            if entry != current and CAPTURE_DIR_PATTERN.match(entry)
+            and os.path.isdir(os.path.join(self.output_dir, entry))
+        )
+        for old in captures[:max(0, len(captures) - (self.keep - 1))]:
+            shutil.rmtree(os.path.join(self.output_dir, old), ignore_errors=True)
@@ -0,0 +1,468 @@
+import os
+import sys
+import math
+import time
+import heapq
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# --- End-to-End Workflow Load Simulator ---
+# Drives a scratch copy of epics.db through the full letter lifecycle while the
+# real MAS engine (mas_workflow.py: LCA, PPA, Router, commit) processes the queue:
+#
+#   /api/autofill (ML_OCR) -> LCA (ML_DRAFTED) -> clerk finalSubmit (Submitted)
+#   -> PPA + Router (Pending@Dean) -> Dean/Registrar/VC/Accounts actions (ActionTaken)
+#   -> Router (Pending@next / Approved / Rejected), with Overdue along the way.
+#
+# The clerk and approver actions run the same SQL as server.js. A fake clock is
+# injected into the engine (mas_workflow.clock_now): it runs at real speed while
+# the engine is working, so OCR/ML cost counts, and jumps over idle gaps to the
+# next arrival, action or approval deadline (rounded up to the engine's 3 s poll).
+#
+# Example (10x the current volume for a simulated week):
+#   python mas_engine/load_simulator.py --days 7 --volume-multiplier 10
+#
+# Emails are never sent. The real epics.db and uploads/ are never written.
+# The derived-artifact cache is off unless --warm-cache is given: the sample
+# uploads are only a handful of distinct files, so with it on nearly every
+# letter after warm-up would time a cache hit instead of OCR.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(SCRIPT_DIR)
+SOURCE_DB_PATH = os.path.join(PARENT_DIR, 'epics.db')
+
+ENGINE_POLL_SECONDS = 3  # mas_workflow.py sleeps 3 s when there is nothing to do
+DEPARTMENTS = ['CSE', 'IT', 'ECE', 'EEE', 'EIE', 'ME', 'Civil', 'MBA', 'MCA']
+APPROVERS = ['Dean', 'Registrar', 'VC', 'Accounts']
+# The router only detects a rejection via deanRemarks / registrarRemarks
+REJECTABLE_STAGES = ('Dean', 'Registrar')
+TERMINAL_STATUSES = ('Approved', 'Rejected')
+
+
+class SimClock:
+    """Fake clock: real time passes normally, advance_to() skips idle periods."""
+
+    def __init__(self, start):
+        self._sim_anchor = start
+        self._real_anchor = time.perf_counter()
+
+    def now(self):
+        return self._sim_anchor + timedelta(seconds=time.perf_counter() - self._real_anchor)
+
+    def advance_to(self, target):
+        if target > self.now():
+            self._sim_anchor = target
+            self._real_anchor = time.perf_counter()
+
+
+def parse_mapping(text, value_type=float):
+    """Parses 'A=1,B=2' into {'A': 1.0, 'B': 2.0}."""
+    mapping = {}
+    for item in (text or '').split(','):
+        if item.strip():
+            key, value = item.split('=')
+            mapping[key.strip()] = value_type(value)
+    return mapping
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+def current_arrivals_per_day(db_path):
+    """Observed letters/day in the source DB (the 1x baseline)."""
+    conn = sqlite3.connect(db_path)
+    count, first, last = conn.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM letters").fetchone()
+    conn.close()
+    if not count:
+        return 2.0
+    days = (datetime.fromisoformat(last[:10]) - datetime.fromisoformat(first[:10])).days + 1
+    return count / max(days, 1)
+
+
+class LoadSimulator:
+
+    def __init__(self, engine, args, start):
+        self.engine = engine
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.clock = SimClock(start)
+        self.start = start
+        self.end = start + timedelta(days=args.days)
+        self.events = []          # heap of (time, seq, kind, payload)
+        self.seq = 0
+        self.letters = {}         # id -> {'status', 'stage', 'since', 'created', 'type', 'amount', ...}
+        self.active = set()       # ids not yet Approved/Rejected
+        self.time_in_status = {}  # 'Pending@Dean' -> [seconds, ...]
+        self.end_to_end = []
+        self.pending_periods = [] # {'id', 'stage', 'deadline', 'start', 'acted', 'overdue'}
+        self.open_period = {}     # id -> index into pending_periods
+        self.invoke_ms = []
+        self.commit_conflicts = 0
+        self.engine_passes = 0
+        self.uploads = self._sample_uploads()
+        self.dept_weights = parse_mapping(args.dept_mix) or {dept: 1.0 for dept in DEPARTMENTS}
+        self.approver_median_hours = {'Dean': 12, 'Registrar': 18, 'VC': 24, 'Accounts': 12}
+        self.approver_median_hours.update(parse_mapping(args.approver_median_hours))
+
+    # --- scheduling ---
+
+    def schedule(self, when, kind, payload):
+        self.seq += 1
+        heapq.heappush(self.events, (when, self.seq, kind, payload))
+
+    def _sample_uploads(self):
+        files = sorted(
+            os.path.join('uploads', name) for name in os.listdir(os.path.join(PARENT_DIR, 'uploads'))
+            if name.startswith('file-') and os.path.splitext(name)[1].lower() in ('.pdf', '.png', '.jpg', '.jpeg')
+        ) if os.path.isdir(os.path.join(PARENT_DIR, 'uploads')) else []
+        return files or [None]
+
+    def _lognormal_seconds(self, median_seconds):
+        return self.rng.lognormvariate(math.log(median_seconds), self.args.response_sigma)
+
+    def schedule_arrivals(self):
+        per_second = self.args.arrivals_per_day * self.args.volume_multiplier / 86400
+        t = self.start
+        n = 0
+        while True:
+            t += timedelta(seconds=self.rng.expovariate(per_second))
+            if t >= self.end:
+                break
+            n += 1
+            self.schedule(t, 'arrival', n)
+        return n
+
+    # --- actors (same SQL as server.js) ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self.engine.DB_PATH)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def autofill(self, n):
+        """POST /api/autofill: insertLetter() with status ML_OCR at stage Clerk."""
+        dept = self.rng.choices(list(self.dept_weights), weights=list(self.dept_weights.values()))[0]
+        letter_id = f"SIM-{dept}-{n:06d}"
+        letter_type = 'Payment' if self.rng.random() < self.args.payment_share else 'Permission'
+        amount = int(self.rng.lognormvariate(math.log(40000), 1.0)) if letter_type == 'Payment' else 0
+        now = self.clock.now()
+        conn = self._connect()
+        conn.execute(
+            """INSERT INTO letters (id, subject, dept, type, amount, date, status, remarks, stage, filePath, classification)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (letter_id, 'Scanning...', dept, 'Unknown', 0, now.strftime('%Y-%m-%d'), 'ML_OCR',
+             'Awaiting MAS analysis', 'Clerk', self.rng.choice(self.uploads), 'Unknown'))
+        conn.commit()
+        conn.close()
+        self.letters[letter_id] = {'status': None, 'stage': None, 'since': now, 'created': now,
+                                   'type': letter_type, 'amount': amount, 'submitted': False}
+        self.active.add(letter_id)
+
+    def final_submit(self, letter_id):
+        """PUT /api/:id action=finalSubmit by the clerk (accepts the draft, fixes type/amount)."""
+        info = self.letters[letter_id]
+        conn = self._connect()
+        row = conn.execute("SELECT subject FROM letters WHERE id = ?", (letter_id,)).fetchone()
+        conn.execute(
+            "UPDATE letters SET subject = ?, type = ?, amount = ?, status = ?, remarks = ?, stage = ?, version = version + 1 WHERE id = ?",
+            (row['subject'], info['type'], info['amount'], 'Submitted', 'Clerk final submission', 'Clerk', letter_id))
+        conn.commit()
+        conn.close()
+
+    def approver_action(self, letter_id, stage):
+        """PUT /api/:id by an approver: updateLetterApproval + updateLetterWorkflow(ActionTaken)."""
+        conn = self._connect()
+        row = conn.execute("SELECT status, stage, approvalDeadline FROM letters WHERE id = ?", (letter_id,)).fetchone()
+        if row is None or row['stage'] != stage or row['status'] not in ('Pending', 'Overdue'):
+            conn.close()
+            return
+        now = self.clock.now()
+        reject = stage in REJECTABLE_STAGES and self.rng.random() < self.args.reject_rate
+        action = 'reject' if reject else 'forward'
+        remarks = 'Rejected: insufficient justification' if reject else 'Approved, forwarding'
+        if stage in REJECTABLE_STAGES:
+            prefix = stage.lower()
+            conn.execute(
+                f"UPDATE letters SET {prefix}Remarks = ?, {prefix}ApprovedDate = ?, {prefix}SignedPath = ?, version = version + 1 WHERE id = ?",
+                (remarks, now.isoformat(), None, letter_id))
+        conn.execute(
+            "UPDATE letters SET stage = ?, status = ?, remarks = ?, approvalDeadline = ?, version = version + 1 WHERE id = ?",
+            (stage, 'ActionTaken', f"Action: {action} by {stage}", row['approvalDeadline'], letter_id))
+        conn.commit()
+        conn.close()
+        if letter_id in self.open_period:
+            self.pending_periods[self.open_period.pop(letter_id)]['acted'] = now
+
+    def fire(self, kind, payload):
+        if kind == 'arrival':
+            self.autofill(payload)
+        elif kind == 'clerk_submit':
+            self.final_submit(payload)
+        elif kind == 'approver_action':
+            self.approver_action(*payload)
+
+    # --- engine ---
+
+    def _invoke(self, event):
+        snapshot = self.engine.LetterSnapshot(event)
+        start = time.perf_counter()
+        result = self.engine_app.invoke({'letter_id': event['id'], 'letter': snapshot})
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return elapsed_ms, result.get('committed') is False
+
+    def run_engine_pass(self, pool):
+        """One iteration of the engine's main loop over get_pending_events()."""
+        events = self.engine.get_pending_events()
+        if not events:
+            return 0
+        self.engine_passes += 1
+        for elapsed_ms, conflict in pool.map(self._invoke, events):
+            self.invoke_ms.append(elapsed_ms)
+            self.commit_conflicts += conflict
+        return len(events)
+
+    def next_deadline(self):
+        conn = self._connect()
+        value = conn.execute(
+            "SELECT MIN(approvalDeadline) FROM letters WHERE status = 'Pending' AND approvalDeadline IS NOT NULL").fetchone()[0]
+        conn.close()
+        return datetime.fromisoformat(value) if value else None
+
+    # --- observation ---
+
+    def _status_key(self, status, stage):
+        return f"{status}@{stage}" if status in ('Pending', 'Overdue', 'ActionTaken') else status
+
+    def observe(self):
+        """Records status transitions of in-flight letters and schedules the actor reactions."""
+        if not self.active:
+            return
+        now = self.clock.now()
+        ids = list(self.active)
+        conn = self._connect()
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows += conn.execute(
+                f"SELECT id, status, stage, approvalDeadline FROM letters WHERE id IN ({', '.join('?' for _ in chunk)})",
+                chunk).fetchall()
+        conn.close()
+
+        for row in rows:
+            info = self.letters[row['id']]
+            if (row['status'], row['stage']) == (info['status'], info['stage']):
+                continue
+            if info['status'] is not None:
+                key = self._status_key(info['status'], info['stage'])
+                self.time_in_status.setdefault(key, []).append((now - info['since']).total_seconds())
+            info.update(status=row['status'], stage=row['stage'], since=now)
+            self._react(row, info, now)
+
+    def _react(self, row, info, now):
+        letter_id, status, stage = row['id'], row['status'], row['stage']
+        if status in ('ML_DRAFTED', 'ERROR') and stage == 'Clerk' and not info['submitted']:
+            info['submitted'] = True
+            self.schedule(now + timedelta(seconds=self._lognormal_seconds(self.args.clerk_median_minutes * 60)),
+                          'clerk_submit', letter_id)
+        elif status == 'Pending':
+            self.open_period[letter_id] = len(self.pending_periods)
+            self.pending_periods.append({'id': letter_id, 'stage': stage, 'start': now, 'acted': None, 'overdue': None,
+                                         'deadline': datetime.fromisoformat(row['approvalDeadline'])})
+            median = self.approver_median_hours.get(stage, 12) * 3600
+            self.schedule(now + timedelta(seconds=self._lognormal_seconds(median)), 'approver_action', (letter_id, stage))
+        elif status == 'Overdue' and letter_id in self.open_period:
+            self.pending_periods[self.open_period[letter_id]]['overdue'] = now
+        elif status in TERMINAL_STATUSES:
+            self.end_to_end.append((now - info['created']).total_seconds())
+            self.active.discard(letter_id)
+
+    # --- main loop ---
+
+    def run(self):
+        self.engine_app = self.engine.create_mas_graph()
+        arrivals = self.schedule_arrivals()
+        print(f"[Sim] {arrivals} arrivals over {self.args.days} simulated day(s) "
+              f"({self.args.arrivals_per_day * self.args.volume_multiplier:.1f}/day, {self.args.workers} engine worker(s)).")
+        wall_start = time.perf_counter()
+        last_progress = wall_start
+
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            while True:
+                now = self.clock.now()
+                while self.events and self.events[0][0] <= now:
+                    _, _, kind, payload = heapq.heappop(self.events)
+                    self.fire(kind, payload)
+                self.observe()
+
+                if self.run_engine_pass(pool):
+                    self.observe()
+                    continue  # the engine loops again immediately after processing
+
+                # Idle: jump to the next thing that can happen, on the engine's poll grid
+                candidates = [t for t in (self.events[0][0] if self.events else None, self.next_deadline()) if t]
+                if not candidates or min(candidates) > self.end + timedelta(days=self.args.drain_days):
+                    break
+                wake = min(candidates) + timedelta(microseconds=1)
+                polls = math.ceil((wake - self.start).total_seconds() / ENGINE_POLL_SECONDS)
+                self.clock.advance_to(self.start + timedelta(seconds=polls * ENGINE_POLL_SECONDS))
+
+                if time.perf_counter() - last_progress > 10:
+                    last_progress = time.perf_counter()
+                    print(f"[Sim] t={self.clock.now():%Y-%m-%d %H:%M} in-flight={len(self.active)} "
+                          f"done={len(self.end_to_end)} engine invocations={len(self.invoke_ms)}")
+
+        self.sim_end = self.clock.now()
+        self.wall_seconds = time.perf_counter() - wall_start
+
+    # --- report ---
+
+    def report(self):
+        def fmt(seconds):
+            if seconds is None:
+                return '-'
+            return f"{seconds / 3600:.2f}h" if seconds >= 3600 else f"{seconds:.1f}s"
+
+        print("\n=== Load Simulation Report ===")
+        print(f"Simulated {self.start:%Y-%m-%d %H:%M} -> {self.sim_end:%Y-%m-%d %H:%M} in {self.wall_seconds:.1f} s wall time")
+        print(f"Letters created: {len(self.letters)}, finished: {len(self.end_to_end)}, still in flight: {len(self.active)}")
+        print(f"Engine passes: {self.engine_passes}, invocations: {len(self.invoke_ms)}, commit conflicts: {self.commit_conflicts}")
+
+        print(f"\n{'Status':<24}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for key in sorted(self.time_in_status):
+            values = self.time_in_status[key]
+            print(f"{key:<24}{len(values):>7}{fmt(percentile(values, 50)):>10}{fmt(percentile(values, 95)):>10}{fmt(percentile(values, 99)):>10}")
+        print(f"{'END-TO-END':<24}{len(self.end_to_end):>7}{fmt(percentile(self.end_to_end, 50)):>10}"
+              f"{fmt(percentile(self.end_to_end, 95)):>10}{fmt(percentile(self.end_to_end, 99)):>10}")
+        if self.invoke_ms:
+            print(f"\nEngine app.invoke latency: p50 {percentile(self.invoke_ms, 50):.1f} ms, "
+                  f"p95 {percentile(self.invoke_ms, 95):.1f} ms, p99 {percentile(self.invoke_ms, 99):.1f} ms")
+
+        # Deadline / overdue accuracy: a period should be marked Overdue iff the
+        # approver had not acted by approvalDeadline.
+        correct_on_time, correct_overdue, missed, false_overdue, lags = 0, 0, 0, 0, []
+        for period in self.pending_periods:
+            acted = period['acted'] or (None if self.sim_end < period['deadline'] else self.sim_end)
+            should_be_overdue = acted is not None and acted > period['deadline']
+            if period['acted'] is None and self.sim_end <= period['deadline']:
+                continue  # still running, nothing to judge yet
+            if should_be_overdue and period['overdue']:
+                correct_overdue += 1
+                lags.append((period['overdue'] - period['deadline']).total_seconds())
+            elif should_be_overdue:
+                missed += 1
+            elif period['overdue']:
+                false_overdue += 1
+            else:
+                correct_on_time += 1
+        judged = correct_on_time + correct_overdue + missed + false_overdue
+        print(f"\nDeadline accuracy over {judged} approval period(s):")
+        print(f"  on time, not flagged: {correct_on_time}")
+        print(f"  overdue, flagged:     {correct_overdue}")
+        print(f"  overdue, NOT flagged: {missed}")
+        print(f"  flagged too early:    {false_overdue}")
+        if lags:
+            print(f"  overdue detection lag: p50 {fmt(percentile(lags, 50))}, p99 {fmt(percentile(lags, 99))}, max {fmt(max(lags))}")
+        accurate = missed == 0 and false_overdue == 0
+        print(f"  => Deadline/overdue logic {'ACCURATE' if accurate else 'INACCURATE'} at {self.args.volume_multiplier}x volume")
+
+
+class NoDerivedCache:
+    """Stands in for upload_store.DERIVED_CACHE: every lookup misses, nothing is written."""
+
+    def get_json(self, digest, name):
+        return None
+
+    def get_image(self, digest, name):
+        return None
+
+    def put_json(self, digest, name, value):
+        return None
+
+    def put_image(self, digest, name, image):
+        return None
+
+
+def load_engine(scratch_db, warm_cache=False):
+    """
+    Imports mas_workflow pointed at the scratch DB, with email disabled and a
+    scratch upload store. Uploads are not ingested, so the real uploads/ files
+    are never replaced by links into the (temporary) scratch store. Unless
+    warm_cache is set, the derived-artifact cache is disabled so every letter
+    pays the real OCR/ML cost.
+    """
+    scratch_dir = os.path.dirname(scratch_db)
+    os.environ['ARCHIVE_DB_PATH'] = os.path.join(scratch_dir, 'epics_archive.db')
+    os.environ['UPLOAD_STORE_DIR'] = os.path.join(scratch_dir, 'cas')
+    sys.path.insert(0, SCRIPT_DIR)
+    import mas_workflow
+    mas_workflow.DB_PATH = scratch_db
+    mas_workflow.SENDER_EMAIL = None
+    mas_workflow._ingest_upload = lambda file_path_relative: None
+    if not warm_cache:
+        mas_workflow.DERIVED_CACHE = NoDerivedCache()
+    return mas_workflow
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate letter traffic end-to-end against a scratch copy of epics.db")
+    parser.add_argument('--days', type=float, default=7, help="Simulated days of arrivals (default: 7)")
+    parser.add_argument('--drain-days', type=float, default=14, help="Extra simulated days to let in-flight letters finish")
+    parser.add_argument('--arrivals-per-day', type=float, default=None,
+                        help="Baseline arrivals per day (default: observed rate in epics.db)")
+    parser.add_argument('--volume-multiplier', type=float, default=1.0, help="Scale the arrival rate, e.g. 10 for 10x")
+    parser.add_argument('--dept-mix', default='', help="Department weights, e.g. CSE=3,IT=2,ECE=1 (default: uniform)")
+    parser.add_argument('--payment-share', type=float, default=0.5, help="Share of Payment letters (default: 0.5)")
+    parser.add_argument('--clerk-median-minutes', type=float, default=30, help="Median clerk review time")
+    parser.add_argument('--approver-median-hours', default='',
+                        help="Median approver response per role, e.g. Dean=12,Registrar=18,VC=24,Accounts=12")
+    parser.add_argument('--response-sigma', type=float, default=1.0, help="Lognormal sigma of response times")
+    parser.add_argument('--reject-rate', type=float, default=0.1, help="Rejection probability at Dean/Registrar")
+    parser.add_argument('--workers', type=int, default=1, help="Parallel engine workers (default: 1, like mas_workflow.py)")
+    parser.add_argument('--keep-letters', action='store_true', help="Keep the existing letters in the scratch copy")
+    parser.add_argument('--scratch-dir', default=None, help="Where to put the scratch DB (default: a temp dir, deleted after)")
+    parser.add_argument('--warm-cache', action='store_true',
+                        help="Reuse OCR/rasterization results for repeated sample uploads (default: off)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(SOURCE_DB_PATH):
+        print(f"Error: Database not found at {SOURCE_DB_PATH}. Please run 'node server.js' first to create it.")
+        exit()
+    if args.arrivals_per_day is None:
+        args.arrivals_per_day = current_arrivals_per_day(SOURCE_DB_PATH)
+
+    scratch_dir = args.scratch_dir or tempfile.mkdtemp(prefix='epics-sim-')
+    os.makedirs(scratch_dir, exist_ok=True)
+    scratch_db = os.path.join(scratch_dir, 'epics.db')
+    shutil.copyfile(SOURCE_DB_PATH, scratch_db)
+    print(f"[Sim] Scratch database: {scratch_db}")
+
+    engine = load_engine(scratch_db, warm_cache=args.warm_cache)
+    print(f"[Sim] Derived-artifact cache: {'on' if args.warm_cache else 'off (every letter is OCR-ed)'}")
+    engine.ensure_letter_schema()
+    if not args.keep_letters:
+        conn = sqlite3.connect(scratch_db)
+        conn.execute("DELETE FROM letters")
+        conn.execute("DELETE FROM letter_texts")
+        conn.commit()
+        conn.close()
+
+    simulator = LoadSimulator(engine, args, start=engine.clock_now())
+    engine.clock_now = simulator.clock.now
+    try:
+        simulator.run()
+    finally:
+        engine.BACKGROUND_OCR.shutdown(wait=True)
+    simulator.report()
+
+    if not args.scratch_dir:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
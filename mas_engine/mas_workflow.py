@@ -10,15 +10,22 @@ from dotenv import load_dotenv
 # Email & SSL Imports 
 import smtplib
 import ssl
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from datetime import datetime, timedelta
 
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 import pytesseract
 
+from letter_profiler import LetterProfiler
+from letter_archive import attach_archive, archive_terminal_letters, get_retention_days
+from upload_store import DERIVED_CACHE, content_hash, ingest
+
 load_dotenv()
 
 # --- Tesseract OCR Configuration ---
@@ -67,7 +74,7 @@ except FileNotFoundError:
 # --- !! IMPORTANT: Fill in your Email Details !! ---
 # This is required for Aim 6 (Email Notifications)
 SMTP_SERVER = os.getenv('SMTP_SERVER') 
-SMTP_PORT = int(os.getenv('SMTP_PORT')) 
+SMTP_PORT = int(os.getenv('SMTP_PORT') or 465) 
 # VVVVVVVV SENDER CONFIGURATION: SET TO YOUR TEST EMAIL VVVVVVVV
 SENDER_EMAIL = os.getenv('SENDER_EMAIL') 
 SENDER_PASSWORD = os.getenv('SENDER_PASSWORD')
@@ -75,6 +82,13 @@ SENDER_PASSWORD = os.getenv('SENDER_PASSWORD')
 # --- END NEW/MODIFIED ---
 
 
+def clock_now():
+    """
+    Current time for workflow decisions (approval deadlines, overdue checks).
+    load_simulator.py replaces this with a fake clock.
+    """
+    return datetime.now()
+
 def get_db_connection():
     """Connects to the SQLite database using the robust path."""
     if not os.path.exists(DB_PATH):
@@ -83,36 +97,90 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
-def update_letter_state(letter_id, **kwargs):
-    """Dynamically updates fields for a given letter ID."""
+# Columns added after the original schema: (name, definition). server.js adds them on startup too.
+ADDED_LETTER_COLUMNS = [
+    ('version', 'INTEGER NOT NULL DEFAULT 0'),   # optimistic lock for LetterSnapshot.commit()
+    ('extractionMethod', 'TEXT'),                # how LCA got the text: text_layer / roi_ocr / mixed / ocr / image_ocr / none
+    ('closedAt', 'TEXT'),                        # set by the router on Approved/Rejected; archive retention counts from it
+]
+
+def ensure_letter_schema():
+    """
+    Adds any ADDED_LETTER_COLUMNS missing from a DB created before they existed,
+    and creates the engine-owned 'letter_texts' table (full OCR text for PPA).
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS letter_texts (
+                letterId TEXT PRIMARY KEY,
+                fullText TEXT,
+                method TEXT,
+                extractedAt TEXT
+            )
+        """)
+        conn.commit()
+        columns = [row['name'] for row in conn.execute("PRAGMA main.table_info(letters)")]
+        for name, definition in ADDED_LETTER_COLUMNS:
+            if name not in columns:
+                conn.execute(f"ALTER TABLE letters ADD COLUMN {name} {definition}")
+                conn.commit()
+                print(f"*** Added '{name}' column to letters table ***")
+    finally:
+        conn.close()
+
+def update_letter_state(letter_id, expected_version=None, **kwargs):
+    """
+    Dynamically updates fields for a given letter ID in a single UPDATE.
+    If expected_version is given, the write only applies when the row is
+    still at that version (optimistic lock) and the version is bumped.
+    Returns True if the row was written, False if no row matched (version
+    conflict or unknown id) and None if the database raised an error.
+    """
     if not kwargs:
-        return
+        return True
     conn = get_db_connection()
     cursor = conn.cursor()
     set_clauses = [f"{key} = ?" for key in kwargs.keys()]
     set_values = list(kwargs.values())
-    set_values.append(letter_id)
-    query = f"UPDATE letters SET {', '.join(set_clauses)} WHERE id = ?"
+    query = f"UPDATE letters SET {', '.join(set_clauses)}"
+    if expected_version is None:
+        query += " WHERE id = ?"
+        set_values.append(letter_id)
+    else:
+        query += ", version = version + 1 WHERE id = ? AND version = ?"
+        set_values.extend([letter_id, expected_version])
     try:
         cursor.execute(query, set_values)
         conn.commit()
+        return cursor.rowcount == 1
     except sqlite3.Error as e:
         print(f"   [DB ERROR] Failed to update letter {letter_id}: {e}")
+        return None
     finally:
         conn.close()
 
 
 def get_letter_by_id(letter_id):
-    """Fetches a single letter record."""
+    """Fetches a single letter record: the active one, else the most recently archived."""
     conn = get_db_connection()
     letter = conn.cursor().execute("SELECT * FROM letters WHERE id = ?", (letter_id,)).fetchone()
+    if letter is None:
+        # Archived letters live in epics_archive.db; 'all_letters' spans both.
+        try:
+            attach_archive(conn)
+            letter = conn.cursor().execute(
+                "SELECT * FROM all_letters WHERE id = ? ORDER BY archiveId IS NOT NULL, archiveId DESC LIMIT 1",
+                (letter_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"   [DB ERROR] Could not read the archive for letter {letter_id}: {e}")
     conn.close()
     return dict(letter) if letter else None
 
 def get_pending_events():
     """Fetches letters that need Agent attention."""
     conn = get_db_connection()
-    current_time = datetime.now().isoformat()
+    current_time = clock_now().isoformat()
     query = f"""
     SELECT * FROM letters 
     WHERE status IN ('ML_OCR', 'Submitted', 'ActionTaken') 
@@ -128,76 +196,446 @@ def get_pending_events():
 
 # --- 3. LangGraph State Definition ---
 
+class LetterSnapshot:
+    """
+    In-memory copy of one 'letters' row, loaded once per graph run.
+    Agents read fields from it and record changes with set(); commit()
+    writes all pending changes back in one version-guarded UPDATE, so an
+    edit made by server.js in the meantime is detected, not overwritten.
+    """
+    __slots__ = (
+        'id', 'subject', 'dept', 'type', 'amount', 'date', 'status', 'remarks',
+        'stage', 'filePath', 'classification', 'priorityScore', 'estimatedTime',
+        'approvalDeadline', 'signedFilePath', 'chequeFilePath', 'deanRemarks',
+        'deanApprovedDate', 'deanSignedPath', 'registrarRemarks',
+        'registrarApprovedDate', 'registrarSignedPath', 'extractionMethod', 'closedAt', 'version', '_changes',
+    )
+
+    id: str
+    subject: str
+    dept: str
+    type: str
+    amount: Optional[int]
+    date: str
+    status: str
+    remarks: Optional[str]
+    stage: str
+    filePath: Optional[str]
+    classification: Optional[str]
+    priorityScore: Optional[int]
+    estimatedTime: Optional[str]
+    approvalDeadline: Optional[str]
+    signedFilePath: Optional[str]
+    chequeFilePath: Optional[str]
+    deanRemarks: Optional[str]
+    deanApprovedDate: Optional[str]
+    deanSignedPath: Optional[str]
+    registrarRemarks: Optional[str]
+    registrarApprovedDate: Optional[str]
+    registrarSignedPath: Optional[str]
+    extractionMethod: Optional[str]
+    closedAt: Optional[str]
+    version: int
+
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, row: dict):
+        for field in self.FIELDS:
+            setattr(self, field, row.get(field))
+        self.version = row.get('version') or 0
+        self._changes = {}
+
+    @classmethod
+    def load(cls, letter_id) -> Optional['LetterSnapshot']:
+        """Reads the row once; returns None if the letter does not exist."""
+        row = get_letter_by_id(letter_id)
+        return cls(row) if row else None
+
+    def get(self, field, default=None):
+        """dict-style access so agents can keep using letter.get('...')."""
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def set(self, **changes):
+        """Applies changes in memory and queues them for commit()."""
+        for field, value in changes.items():
+            if field not in self.FIELDS or field in ('id', 'version'):
+                raise KeyError(f"Unknown or read-only letter field: {field}")
+            setattr(self, field, value)
+            self._changes[field] = value
+
+    def commit(self) -> Optional[bool]:
+        """
+        Writes all queued changes in one UPDATE guarded by the loaded version.
+        Returns False on a version conflict and None on a database error; in
+        both cases the changes stay queued.
+        """
+        if not self._changes:
+            return True
+        written = update_letter_state(self.id, expected_version=self.version, **self._changes)
+        if not written:
+            return written
+        self.version += 1
+        self._changes = {}
+        return True
+
+
 class WorkflowState(TypedDict):
     letter_id: str
+    letter: Optional[LetterSnapshot]
+    next: Optional[str]
+    committed: Optional[bool]
     notification_needed: Optional[bool]
     notification_target_email: Optional[str]
     notification_message: Optional[str]
 
 
 # --- 4. Agent Functions (Nodes) ---
-def _get_full_text(file_path_relative: str) -> str:
+# Poppler ships both pdftoppm (used by pdf2image) and pdftotext.
+POPPLER_PATH = os.getenv('POPPLER_PATH') or r"C:\Program Files\poppler-25.07.0\Library\bin"
+
+# Common English / official-letter words used to judge whether an embedded text
+# layer is real text or garbage (e.g. a scanned PDF with a broken font mapping).
+COMMON_WORDS = set("""
+the of and to in a is for on that with as by this be are from at or it we our your you
+has have was were will would can may should all any not no which their there these those
+an if its been being also into than then them they he she his her i me my us
+sir madam dear respected subject sub date ref reference regarding request kindly please
+permission payment amount rs inr sanction approval approve approved grant fund funds
+letter department dept college university institute principal dean registrar vc hod
+faculty student students staff event workshop seminar conference program programme
+bill invoice purchase expenditure budget academic year semester thanking thank yours
+faithfully sincerely regards submitted forward forwarded necessary required same
+""".split())
+
+def _text_layer_is_usable(page_text: str) -> bool:
     """
-    Helper function to extract text from either PDF or image files using Tesseract OCR.
-    Supports both image formats (PNG, JPG, JPEG) and PDF files.
-    Includes safety for missing Poppler and missing Tesseract path.
+    Heuristics for an embedded PDF text layer:
+    - enough characters on the page and mostly letters/digits/spaces (density), and
+    - a reasonable share of tokens are common words (dictionary hit rate).
+    Pages that fail are OCR'd instead.
     """
-    import os
-    from PIL import Image
-    import pytesseract
-    from pdf2image import convert_from_path
-
-    # ✅ Ensure Tesseract path is set correctly
-    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+    stripped = page_text.strip()
+    if len(stripped) < 40:
+        return False
+    clean_chars = sum(1 for ch in stripped if ch.isalnum() or ch.isspace() or ch in ".,:;-/()'\"&@")
+    if clean_chars / len(stripped) < 0.85:
+        return False
+    words = re.findall(r"[a-z]{2,}", stripped.lower())
+    if len(words) < 8:
+        return False
+    hits = sum(1 for w in words if w in COMMON_WORDS)
+    return hits / len(words) >= 0.15
+
+def _pdftotext_pages(file_path_absolute: str) -> list:
+    """Runs poppler's pdftotext and returns one string per page ([] if unavailable)."""
+    exe_name = 'pdftotext.exe' if os.name == 'nt' else 'pdftotext'
+    exe = os.path.join(POPPLER_PATH, exe_name)
+    if not os.path.exists(exe):
+        exe = shutil.which('pdftotext')
+    if not exe:
+        print("   [OCR_HELPER_WARNING] pdftotext not found. Skipping text layer.")
+        return []
+    try:
+        result = subprocess.run([exe, '-enc', 'UTF-8', file_path_absolute, '-'],
+                                capture_output=True, timeout=30, check=True)
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"   [OCR_HELPER_WARNING] pdftotext failed: {e}")
+        return []
+    # pdftotext ends every page with a form feed
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    return pages[:-1] if pages and not pages[-1].strip() else pages
+
+# Own queue for derived-cache writes: behind a running OCR job each queued
+# ~26 MB page image would stay in memory until the whole document finished.
+CACHE_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-write')
+
+# Bump when extraction logic changes so stale cached text is not reused
+EXTRACTION_CACHE_VERSION = 1
+FULL_TEXT_CACHE_NAME = f"fulltext-v{EXTRACTION_CACHE_VERSION}.json"
+
+def _rasterize_pdf_page(file_path_absolute: str, page_number: int, dpi: int = 300):
+    """Rasterizes a single PDF page (1-based); returns a PIL image or None. Cached per file hash."""
+    digest = content_hash(file_path_absolute)
+    name = f"page{page_number}@{dpi}dpi.png"
+    image = DERIVED_CACHE.get_image(digest, name)
+    if image is not None:
+        return image
+    images = convert_from_path(file_path_absolute, dpi=dpi, poppler_path=POPPLER_PATH,
+                               first_page=page_number, last_page=page_number)
+    if not images:
+        return None
+    # Encoding a 300 dpi PNG takes a few hundred ms; don't make LCA (or the OCR job) wait for it
+    CACHE_WRITER.submit(_cache_page_image, digest, name, images[0])
+    return images[0]
+
+def _cache_page_image(digest, name, image):
+    try:
+        DERIVED_CACHE.put_image(digest, name, image)
+    except OSError as e:
+        print(f"   [Upload Store WARNING] Could not cache {name} for {digest[:12]}: {e}")
 
-    # ✅ Check that OCR is enabled and file path is valid
-    if not TESSERACT_ENABLED or not file_path_relative:
-        return ""
+def _ocr_pdf_page(file_path_absolute: str, page_number: int, nice: int = 0) -> str:
+    """Rasterizes a single PDF page (1-based) at 300 dpi and OCRs it."""
+    image = _rasterize_pdf_page(file_path_absolute, page_number)
+    return pytesseract.image_to_string(image, lang="eng", config="--psm 6", nice=nice) if image else ""
 
+def _resolve_upload_path(file_path_relative: str) -> str:
     script_dir = os.path.dirname(os.path.abspath(__file__))
     parent_dir = os.path.dirname(script_dir)
-    file_path_absolute = os.path.join(parent_dir, file_path_relative)
+    return os.path.join(parent_dir, file_path_relative)
+
+def _extract_text(file_path_relative: str, nice: int = 0):
+    """
+    Extracts text from a PDF or image and returns (text, method).
+    PDFs use the embedded text layer (pdftotext) for every page where it looks
+    usable and only rasterize + OCR the remaining pages.
+    method is one of: 'text_layer', 'mixed', 'ocr', 'image_ocr', 'none'.
+    nice > 0 runs tesseract at lower CPU priority (ignored on Windows).
+    The tesseract executable comes from TESSERACT_PATH (set at import).
+    """
+    if not file_path_relative:
+        return "", 'none'
+
+    file_path_absolute = _resolve_upload_path(file_path_relative)
 
     if not os.path.exists(file_path_absolute):
         print(f"   [OCR_HELPER_ERROR] File not found: {file_path_absolute}")
-        return ""
+        return "", 'none'
+
+    # Same content (reprocessing or a duplicate upload) -> reuse the earlier result
+    digest = content_hash(file_path_absolute)
+    cache_name = FULL_TEXT_CACHE_NAME
+    cached = DERIVED_CACHE.get_json(digest, cache_name)
+    if cached is not None:
+        print(f"   [OCR_HELPER] Using cached text for {digest[:12]} ({cached['method']}).")
+        return cached['text'], cached['method']
 
     text = ""
+    method = 'none'
     ext = os.path.splitext(file_path_absolute)[1].lower()
 
     try:
-        # --- Handle PDFs ---
+        # --- Handle PDFs: text layer first, OCR per page as fallback ---
         if ext == ".pdf":
-            print("   [OCR_HELPER] Converting PDF to images for OCR...")
-            try:
-                # ✅ If Poppler is installed, specify its path here
-                poppler_path = r"C:\Program Files\poppler-25.07.0\Library\bin"
-                pages = convert_from_path(file_path_absolute, dpi=300, poppler_path=poppler_path)
-            except Exception as e:
-                print(f"   [OCR_HELPER_WARNING] Poppler not found or failed: {e}")
-                print("   [OCR_HELPER] Skipping PDF OCR (install Poppler to enable).")
-                return ""
-
-            for i, page in enumerate(pages):
-                page_text = pytesseract.image_to_string(page, lang="eng", config="--psm 6")
+            layer_pages = _pdftotext_pages(file_path_absolute)
+            if not layer_pages and TESSERACT_ENABLED:
+                try:
+                    layer_pages = [""] * pdfinfo_from_path(file_path_absolute, poppler_path=POPPLER_PATH)["Pages"]
+                except Exception as e:
+                    print(f"   [OCR_HELPER_WARNING] Poppler not found or failed: {e}")
+                    print("   [OCR_HELPER] Skipping PDF OCR (install Poppler to enable).")
+                    return "", 'none'
+
+            text_pages, ocr_pages = 0, 0
+            for i, page_text in enumerate(layer_pages):
+                if not _text_layer_is_usable(page_text):
+                    if not TESSERACT_ENABLED:
+                        continue
+                    print(f"   [OCR_HELPER] Page {i+1} has no usable text layer. Running OCR...")
+                    page_text = _ocr_pdf_page(file_path_absolute, i + 1, nice=nice)
+                    ocr_pages += 1
+                else:
+                    text_pages += 1
                 text += f"\n--- PAGE {i+1} ---\n{page_text}"
 
+            if text_pages and ocr_pages:
+                method = 'mixed'
+            elif text_pages:
+                method = 'text_layer'
+            elif ocr_pages:
+                method = 'ocr'
+            print(f"   [OCR_HELPER] PDF pages from text layer: {text_pages}, OCR'd: {ocr_pages}.")
+
         # --- Handle images directly ---
         elif ext in [".png", ".jpg", ".jpeg", ".tif", ".bmp"]:
+            if not TESSERACT_ENABLED:
+                return "", 'none'
             print("   [OCR_HELPER] Running OCR on image file...")
             img = Image.open(file_path_absolute)
-            text = pytesseract.image_to_string(img, lang="eng", config="--psm 6")
+            text = pytesseract.image_to_string(img, lang="eng", config="--psm 6", nice=nice)
+            method = 'image_ocr'
 
         else:
             print(f"   [OCR_HELPER_WARNING] Unsupported file format: {ext}")
-            return ""
+            return "", 'none'
 
     except Exception as e:
         print(f"   [OCR_HELPER_ERROR] Could not run Tesseract: {e}")
-        return ""
+        return "", 'none'
+
+    print(f"   [OCR_HELPER] Extracted {len(text)} characters of text ({method}).")
+    if method != 'none':
+        DERIVED_CACHE.put_json(digest, cache_name, {'text': text.strip(), 'method': method})
+    return text.strip(), method
+
+def _get_full_text(file_path_relative: str) -> str:
+    """Text only; see _extract_text for how it is obtained."""
+    return _extract_text(file_path_relative)[0]
+
+def _cached_full_text(file_path_relative: str) -> Optional[str]:
+    """Full text from an earlier extraction of the same content, or None (never extracts)."""
+    file_path_absolute = _resolve_upload_path(file_path_relative) if file_path_relative else None
+    if not file_path_absolute or not os.path.exists(file_path_absolute):
+        return None
+    cached = DERIVED_CACHE.get_json(content_hash(file_path_absolute), FULL_TEXT_CACHE_NAME)
+    return cached['text'] if cached else None
+
+
+# --- 4a. Region-of-Interest OCR for LCA ---
+# LCA only needs the letterhead, date, subject and amount, which sit at the top
+# of page 1. In ROI mode it OCRs just that region so the clerk gets the draft
+# quickly; the full document is OCR'd by a low-priority background job and
+# stored in 'letter_texts', where PPA picks it up.
+LCA_ROI_MODE = os.getenv('LCA_ROI_MODE', '1') != '0'
+ROI_LAYOUT_SCALE = 0.33       # downscale for the fast layout pass
+ROI_FALLBACK_FRACTION = 0.40  # top share of the page used when no subject line is found
+ROI_LINES_AFTER_SUBJECT = 3   # subjects often wrap onto the next lines
+BACKGROUND_OCR_NICE = 10
+
+SUBJECT_KEYWORD = re.compile(r'^(subject|sub|regarding|re)\W*$', re.IGNORECASE)
+
+def _snap_to_line_gap(gray_image, y: int, max_shift: int) -> int:
+    """
+    Moves y down to the nearest row without ink (horizontal projection
+    profile) so the crop does not cut a text line in half.
+    """
+    width, height = gray_image.size
+    pixels = gray_image.load()
+    step = max(1, width // 400)
+    for row in range(y, min(height, y + max_shift)):
+        dark = sum(1 for x in range(0, width, step) if pixels[x, row] < 128)
+        if dark == 0:
+            return row
+    return min(height, y + max_shift)
+
+def _find_header_region(page_image):
+    """
+    Fast layout pass: runs image_to_data on a downscaled grayscale copy of the
+    top of the page and returns the crop box (left, top, right, bottom) in full
+    resolution that covers the letterhead down to the end of the subject line.
+    """
+    gray = page_image.convert('L')
+    width, height = gray.size
+    search_height = int(height * 0.6)
+    small = gray.crop((0, 0, width, search_height)).resize(
+        (max(1, int(width * ROI_LAYOUT_SCALE)), max(1, int(search_height * ROI_LAYOUT_SCALE))))
+
+    data = pytesseract.image_to_data(small, lang="eng", config="--psm 3", output_type=pytesseract.Output.DICT)
+    bottom = int(height * ROI_FALLBACK_FRACTION)
+    line_heights = [h for h, word in zip(data['height'], data['text']) if word.strip()]
+    line_height = int((sorted(line_heights)[len(line_heights) // 2] if line_heights else 15) / ROI_LAYOUT_SCALE)
+
+    for i, word in enumerate(data['text']):
+        if SUBJECT_KEYWORD.match(word.strip()):
+            subject_top = int(data['top'][i] / ROI_LAYOUT_SCALE)
+            bottom = subject_top + line_height * 2 * (ROI_LINES_AFTER_SUBJECT + 1)
+            break
 
-    print(f"   [OCR_HELPER] Extracted {len(text)} characters of text.")
-    return text.strip()
+    bottom = _snap_to_line_gap(gray, min(bottom, height), max_shift=line_height * 2)
+    return (0, 0, width, bottom)
+
+def _extract_header_text(file_path_relative: str):
+    """
+    Returns (text, method) for the header/subject region of page 1 only.
+    Uses the PDF text layer when usable, otherwise ROI OCR at 300 dpi.
+    """
+    if not file_path_relative:
+        return "", 'none'
+    file_path_absolute = _resolve_upload_path(file_path_relative)
+    if not os.path.exists(file_path_absolute):
+        print(f"   [OCR_HELPER_ERROR] File not found: {file_path_absolute}")
+        return "", 'none'
+
+    digest = content_hash(file_path_absolute)
+    cache_name = f"header-v{EXTRACTION_CACHE_VERSION}.json"
+    cached = DERIVED_CACHE.get_json(digest, cache_name)
+    if cached is not None:
+        print(f"   [OCR_HELPER] Using cached header text for {digest[:12]} ({cached['method']}).")
+        return cached['text'], cached['method']
+
+    ext = os.path.splitext(file_path_absolute)[1].lower()
+    try:
+        if ext == ".pdf":
+            layer_pages = _pdftotext_pages(file_path_absolute)
+            if layer_pages and _text_layer_is_usable(layer_pages[0]):
+                return layer_pages[0].strip(), 'text_layer'  # pdftotext is cheap, no need to cache
+            if not TESSERACT_ENABLED:
+                return "", 'none'
+            page_image = _rasterize_pdf_page(file_path_absolute, 1)
+        elif ext in [".png", ".jpg", ".jpeg", ".tif", ".bmp"]:
+            if not TESSERACT_ENABLED:
+                return "", 'none'
+            page_image = Image.open(file_path_absolute)
+        else:
+            print(f"   [OCR_HELPER_WARNING] Unsupported file format: {ext}")
+            return "", 'none'
+
+        if page_image is None:
+            return "", 'none'
+        box = _find_header_region(page_image)
+        print(f"   [OCR_HELPER] ROI OCR on header region {box} of page 1 ({page_image.size[0]}x{page_image.size[1]}).")
+        text = pytesseract.image_to_string(page_image.crop(box), lang="eng", config="--psm 6")
+        DERIVED_CACHE.put_json(digest, cache_name, {'text': text.strip(), 'method': 'roi_ocr'})
+        return text.strip(), 'roi_ocr'
+    except Exception as e:
+        print(f"   [OCR_HELPER_ERROR] ROI extraction failed: {e}")
+        return "", 'none'
+
+
+BACKGROUND_OCR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='full-ocr')
+FULL_TEXT_JOBS = {}
+
+def _full_text_job(letter_id, file_path_relative):
+    """Background: OCR the whole document at low priority and store it for PPA."""
+    text, method = _extract_text(file_path_relative, nice=BACKGROUND_OCR_NICE)
+    if method == 'none':
+        # Nothing stored, so PPA falls back to extracting the text itself
+        print(f"   [Background OCR] No text extracted for {letter_id}; not stored.")
+        return text
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO letter_texts (letterId, fullText, method, extractedAt) VALUES (?, ?, ?, ?)",
+            (letter_id, text, method, datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"   [Background OCR] Stored full text for {letter_id} ({len(text)} chars, {method}).")
+    return text
+
+def schedule_full_text(letter_id, file_path_relative):
+    """Queues the deferred full-document OCR for a letter unless one is already in flight."""
+    if letter_id not in FULL_TEXT_JOBS:
+        job = BACKGROUND_OCR.submit(_full_text_job, letter_id, file_path_relative)
+        FULL_TEXT_JOBS[letter_id] = job
+        # Finished jobs are read back from letter_texts, so don't keep the text in memory
+        job.add_done_callback(lambda _: FULL_TEXT_JOBS.pop(letter_id, None))
+
+def get_full_text_for_letter(letter_id, file_path_relative) -> str:
+    """
+    Full document text for PPA: waits for a background job still in flight,
+    otherwise uses the stored result, otherwise extracts it now.
+    """
+    job = FULL_TEXT_JOBS.get(letter_id)
+    if job is not None:
+        try:
+            text = job.result()
+            if text:
+                return text
+        except Exception as e:
+            print(f"   [Background OCR ERROR] Job for {letter_id} failed: {e}")
+    conn = get_db_connection()
+    # Rows from failed extractions (method 'none') are ignored so the text is retried
+    row = conn.execute("SELECT fullText FROM letter_texts WHERE letterId = ? AND method != 'none'",
+                       (letter_id,)).fetchone()
+    conn.close()
+    if row is not None:
+        return row['fullText']
+    return _get_full_text(file_path_relative)
 
 import re
 
@@ -245,18 +683,42 @@ def extract_subject_from_text(raw_text: str) -> str:
     return subject_text if subject_text else "Subject not found"
 
 
+def _ingest_upload(file_path_relative):
+    """Moves a new upload into the content-addressed store (see upload_store.py)."""
+    if not file_path_relative:
+        return
+    file_path_absolute = _resolve_upload_path(file_path_relative)
+    if not os.path.exists(file_path_absolute):
+        return
+    try:
+        digest, action = ingest(file_path_absolute)
+        print(f"   [Upload Store] {file_path_relative}: {action} ({digest[:12]})")
+    except OSError as e:
+        print(f"   [Upload Store WARNING] Could not ingest {file_path_relative}: {e}")
+
+
 def letter_classifying_agent(state: WorkflowState):
     """
     STEP 3 (LCA): Runs Tesseract/Local ML to autofill the clerk's form.
     (This is your existing code, which is correct.)
     """
     letter_id = state['letter_id']
-    letter = get_letter_by_id(letter_id)
+    letter = state['letter']
     file_path_relative = letter.get('filePath')
 
     print(f"[LCA] Processing file for ID {letter_id}...")
-
-    raw_text = _get_full_text(file_path_relative)
+    _ingest_upload(file_path_relative)
+
+    if LCA_ROI_MODE:
+        raw_text, extraction_method = _extract_header_text(file_path_relative)
+        schedule_full_text(letter_id, file_path_relative)
+        # The classifier was trained on full pages; use the full text whenever it
+        # is already known (text-layer PDFs return all of page 1 anyway).
+        classify_text = _cached_full_text(file_path_relative) or raw_text
+    else:
+        raw_text, extraction_method = _extract_text(file_path_relative)
+        classify_text = raw_text
+    letter.set(extractionMethod=extraction_method)
     print(f"   [LCA DEBUG] OCR extracted {len(raw_text)} characters:\n{raw_text[:400]}\n---")
 
 
@@ -266,13 +728,13 @@ def letter_classifying_agent(state: WorkflowState):
         
     if not CLASSIFIER_MODEL:
         print(f"   [LCA] Fallback triggered. Status set to ERROR.")
-        update_letter_state(letter_id, status='ERROR', remarks='LCA Agent failed. Model not loaded.')
+        letter.set(status='ERROR', remarks='LCA Agent failed. Model not loaded.')
         return state
 
     # --- LOCAL PREDICTION LOGIC ---
     try:
         # 1. Classify Type using Naive Bayes
-        predicted_type = CLASSIFIER_MODEL.predict([raw_text])[0]
+        predicted_type = CLASSIFIER_MODEL.predict([classify_text or raw_text])[0]
 
         # 2. Extract Subject using Regex
         predicted_subject = extract_subject_from_text(raw_text)
@@ -286,7 +748,7 @@ def letter_classifying_agent(state: WorkflowState):
 
         print(f"   [LCA] Model Drafted data. Type: {predicted_type}, Subject: {predicted_subject}, Amount: {predicted_amount}")
 
-        update_letter_state(letter_id,
+        letter.set(
             subject=predicted_subject,
             type=predicted_type,
             amount=predicted_amount,
@@ -297,7 +759,7 @@ def letter_classifying_agent(state: WorkflowState):
 
     except Exception as e:
         print(f"   [LCA ERROR] Local prediction failed: {e}")
-        update_letter_state(letter_id, status='ERROR', remarks=f'LCA Agent failed during local ML processing: {e}')
+        letter.set(status='ERROR', remarks=f'LCA Agent failed during local ML processing: {e}')
     # --- END LOCAL PREDICTION LOGIC ---
 
     return state
@@ -309,11 +771,11 @@ def priority_prediction_agent(state: WorkflowState):
     STEP 4 (PPA): Predicts priority based on body content and metadata.
     """
     letter_id = state['letter_id']
-    letter = get_letter_by_id(letter_id)
+    letter = state['letter']
     print(f"[PPA] Predicting priority for letter {letter_id}...")
 
     # 1. Get full text content
-    raw_text = _get_full_text(letter.get('filePath')).lower()
+    raw_text = get_full_text_for_letter(letter_id, letter.get('filePath')).lower()
     
     # 2. Define priority keywords
     PRIORITY_KEYWORDS = {
@@ -344,7 +806,7 @@ def priority_prediction_agent(state: WorkflowState):
         
     estimated_days = (100 - score) // 15 + 2 # Simple estimation logic
 
-    update_letter_state(letter_id,
+    letter.set(
         priorityScore=score,
         estimatedTime=f"{estimated_days} days",
         status='Prioritized'
@@ -361,7 +823,7 @@ def router_agent(state: WorkflowState):
     MODIFIED: All outbound emails are temporarily routed to the test address.
     """
     letter_id = state['letter_id']
-    letter = get_letter_by_id(letter_id)
+    letter = state['letter']
     
     if not letter:
         return state
@@ -381,8 +843,8 @@ def router_agent(state: WorkflowState):
 
     if current_status == 'Prioritized':
         next_stage = 'Dean'
-        deadline = (datetime.now() + timedelta(days=2)).isoformat()
-        update_letter_state(letter_id, stage=next_stage, status='Pending', remarks=f"Pending approval at {next_stage}", approvalDeadline=deadline)
+        deadline = (clock_now() + timedelta(days=2)).isoformat()
+        letter.set(stage=next_stage, status='Pending', remarks=f"Pending approval at {next_stage}", approvalDeadline=deadline)
         state.update({
             'notification_needed': False,
             # ORIGINAL: 'notification_target_email': f"{next_stage.lower()}@siddhartha.com",
@@ -397,7 +859,8 @@ def router_agent(state: WorkflowState):
         is_rejection = "reject" in (letter.get(f"{current_stage.lower()}Remarks", "") or "").lower()
 
         if is_rejection:
-            update_letter_state(letter_id, stage='Clerk', status='Rejected', remarks=f"Rejected by {current_stage}", approvalDeadline=None)
+            letter.set(stage='Clerk', status='Rejected', remarks=f"Rejected by {current_stage}", approvalDeadline=None,
+                       closedAt=clock_now().isoformat())
             state.update({
                 'notification_needed': True,
                 # ORIGINAL: 'notification_target_email': f"clerk@{letter['dept'].lower()}.com",
@@ -409,8 +872,8 @@ def router_agent(state: WorkflowState):
                 current_index = pipeline.index(current_stage)
                 if current_index < len(pipeline) - 1:
                     next_stage = pipeline[current_index + 1]
-                    deadline = (datetime.now() + timedelta(days=2)).isoformat()
-                    update_letter_state(letter_id, stage=next_stage, status='Pending', remarks=f"Forwarded. Pending at {next_stage}", approvalDeadline=deadline)
+                    deadline = (clock_now() + timedelta(days=2)).isoformat()
+                    letter.set(stage=next_stage, status='Pending', remarks=f"Forwarded. Pending at {next_stage}", approvalDeadline=deadline)
                     state.update({
                         'notification_needed': False,
                         # ORIGINAL: 'notification_target_email': f"{next_stage.lower()}@siddhartha.com",
@@ -418,14 +881,15 @@ def router_agent(state: WorkflowState):
                         # 'notification_message': f"New Task: Letter {letter_id} requires your approval."
                     })
                 else: # End of pipeline
-                    update_letter_state(letter_id, status='Approved', remarks='Final approval reached.', approvalDeadline=None)
+                    letter.set(status='Approved', remarks='Final approval reached.', approvalDeadline=None,
+                               closedAt=clock_now().isoformat())
                     state.update({'notification_needed': True, 'notification_message': f"Success: Letter {letter_id} is fully approved."})
             except ValueError:
                 print(f"  [Router ERROR] Stage '{current_stage}' not found in pipeline for classification '{classification}'.")
-                update_letter_state(letter_id, status='ERROR', remarks=f"Invalid stage '{current_stage}' for this letter type.")
+                letter.set(status='ERROR', remarks=f"Invalid stage '{current_stage}' for this letter type.")
 
     elif current_status == 'Pending': # This condition is met for overdue letters
-        update_letter_state(letter_id, status='Overdue', remarks=f'Deadline breached at {current_stage}!')
+        letter.set(status='Overdue', remarks=f'Deadline breached at {current_stage}!')
         state.update({
             'notification_needed': False,
             # ORIGINAL: 'notification_target_email': f"{current_stage.lower()}@siddhartha.com",
@@ -446,7 +910,7 @@ def email_notification_agent(state: WorkflowState):
         return state
 
     letter_id = state.get('letter_id')
-    letter = get_letter_by_id(letter_id)
+    letter = state.get('letter')
     if not letter:
         print(f"[Email Agent] Letter {letter_id} not found.")
         return state
@@ -527,7 +991,7 @@ MAS Automated Workflow System
                 print(f"   [Email Agent WARNING] Could not attach file: {e}")
 
     # --- Send email ---
-    if SENDER_EMAIL == "your-email@gmail.com":
+    if not SENDER_EMAIL or SENDER_EMAIL == "your-email@gmail.com":
         print(f"[Email Agent] SKIPPING EMAIL (configure SENDER_EMAIL and SENDER_PASSWORD).")
         print(f"   Would have sent to: {to_email} | Subject: {subject}")
         return state
@@ -558,7 +1022,7 @@ def analysis_agent(state: WorkflowState):
 
     print("\n--- Admin System Health Check ---")
     print(f"  [Analysis] Pending/Overdue by Stage (Bottlenecks): {dict(bottlenecks)}")
-    print(f"  [Analysis] Status Totals: {dict(status_summary)}")
+    print(f"  [Analysis] Status Totals (active, excl. archive): {dict(status_summary)}")
     print("-----------------------------------")
     return state
 
@@ -567,8 +1031,13 @@ PERMISSION_PIPELINE = ['Dean', 'Registrar', 'VC']
 
 
 def initial_dispatcher(state: WorkflowState):
-    """Decides the first agent to run and stores it in state['next']"""
-    letter = get_letter_by_id(state['letter_id'])
+    """
+    Decides the first agent to run and stores it in state['next'].
+    Loads the letter snapshot once (unless the caller already supplied it);
+    every later node works on that snapshot instead of re-reading the row.
+    """
+    letter = state.get('letter') or LetterSnapshot.load(state['letter_id'])
+    state['letter'] = letter
     if not letter:
         print(f"  [Dispatcher] Letter {state['letter_id']} not found. Ending workflow.")
         state["next"] = "end"
@@ -586,6 +1055,28 @@ def initial_dispatcher(state: WorkflowState):
     return state
 
 
+def commit_agent(state: WorkflowState):
+    """
+    Writes every change the agents recorded on the snapshot in one UPDATE.
+    If server.js edited the letter since it was loaded, nothing is written
+    and the letter is left for the next polling cycle to pick up again.
+    """
+    letter = state['letter']
+    state['committed'] = letter.commit()
+    if state['committed'] is None:
+        print(f"  [Commit] Could not write letter {letter.id} (database error, see above). "
+              f"Discarding agent changes; it will be re-processed.")
+    elif not state['committed']:
+        print(f"  [Commit] Letter {letter.id} was modified concurrently (expected version {letter.version}). "
+              f"Discarding agent changes; it will be re-processed.")
+    return state
+
+
+def _after_commit(state: WorkflowState):
+    """Only notify once the changes the email describes are actually stored."""
+    return "email_notifier" if state.get('committed') and state.get('notification_needed') else "end"
+
+
 
 def create_mas_graph():
     workflow = StateGraph(WorkflowState)
@@ -594,6 +1085,7 @@ def create_mas_graph():
     workflow.add_node("lca", letter_classifying_agent)
     workflow.add_node("ppa", priority_prediction_agent)
     workflow.add_node("router", router_agent)
+    workflow.add_node("commit", commit_agent)
     workflow.add_node("email_notifier", email_notification_agent)
 
     workflow.set_entry_point("initial_dispatcher")
@@ -604,9 +1096,14 @@ def create_mas_graph():
         {"lca": "lca", "ppa": "ppa", "router": "router", "end": END},
     )
 
-    workflow.add_edge("lca", END)
+    workflow.add_edge("lca", "commit")
     workflow.add_edge("ppa", "router")
-    workflow.add_edge("router", "email_notifier")
+    workflow.add_edge("router", "commit")
+    workflow.add_conditional_edges(
+        "commit",
+        _after_commit,
+        {"email_notifier": "email_notifier", "end": END},
+    )
     workflow.add_edge("email_notifier", END)
 
     return workflow.compile()
@@ -616,7 +1113,20 @@ def create_mas_graph():
 if __name__ == "__main__":
     print("--- Starting MAS Workflow Engine ---")
     
+    ensure_letter_schema()
     app = create_mas_graph()
+
+    # Opt-in CPU/memory profiling (see letter_profiler.py). When no trigger is
+    # configured the loop calls app.invoke directly, with no profiling overhead.
+    profiler = LetterProfiler.from_env()
+    if profiler.enabled:
+        print(f"*** Letter profiling enabled: {profiler.describe()} ***")
+
+    # Hot/cold archival (see letter_archive.py), checked at most once an hour while idle.
+    ARCHIVE_CHECK_INTERVAL = timedelta(hours=1)
+    last_archive_check = None
+    if get_retention_days() is not None:
+        print(f"*** Archiving Approved/Rejected letters older than {get_retention_days()} days ***")
         
     # VVVVVVVV REMOVED TEMPORARY TEST BLOCK VVVVVVVV
     # The temporary test block is removed to let the main loop run.
@@ -630,6 +1140,9 @@ if __name__ == "__main__":
             if not pending_events:
                 # --- MODIFIED: Run the admin health check when idle ---
                 analysis_agent({}) 
+                if get_retention_days() is not None and (last_archive_check is None or datetime.now() - last_archive_check > ARCHIVE_CHECK_INTERVAL):
+                    last_archive_check = datetime.now()
+                    archive_terminal_letters(DB_PATH)
                 print("[MAS] No new events found. Sleeping...")
                 import time
                 time.sleep(3)
@@ -640,9 +1153,14 @@ if __name__ == "__main__":
             for event in pending_events:
                 print(f"\n[MAS] PROCESSING LETTER {event['id']} (Status: {event['status']})")
                 
-                initial_state = {'letter_id': event['id']}
+                # The pending query already returned the full row, so reuse it
+                # as the snapshot instead of reading the letter again.
+                initial_state = {'letter_id': event['id'], 'letter': LetterSnapshot(event)}
                 
-                app.invoke(initial_state)
+                if profiler.enabled:
+                    profiler.invoke(event['id'], app.invoke, initial_state)
+                else:
+                    app.invoke(initial_state)
 
         except KeyboardInterrupt:
             print("\n--- Shutting down MAS Workflow Engine ---")
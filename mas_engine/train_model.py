@@ -1,11 +1,148 @@
 import pandas as pd
+import numpy as np
 import joblib
 import os
-from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import CountVectorizer
+import argparse
+import tempfile
+import time
+from sklearn.model_selection import train_test_split, StratifiedKFold, cross_val_score
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
+from sklearn.linear_model import LogisticRegression
+from sklearn.svm import LinearSVC
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import accuracy_score, classification_report
+from joblib import Parallel, delayed
+
+# --- Command Line Options ---
+# Without --select this script trains the single CountVectorizer + Naive Bayes
+# model exactly as before. With --select it benchmarks a grid of candidates.
+parser = argparse.ArgumentParser(description="Train the letter classifier used by mas_workflow.py")
+parser.add_argument('--select', action='store_true',
+                    help="Run cross-validated model selection instead of the default Naive Bayes model")
+parser.add_argument('--cv', type=int, default=5, help="Number of cross-validation folds (default: 5)")
+parser.add_argument('--n-jobs', type=int, default=-1, help="Parallel jobs for cross-validation (default: all cores)")
+parser.add_argument('--latency-budget-ms', type=float, default=5.0,
+                    help="Max p99 single-letter predict latency for the saved model (default: 5.0 ms)")
+parser.add_argument('--report', help="Optional CSV file to write the benchmark table to")
+args = parser.parse_args()
+
+
+# --- Model Selection Helpers ---
+
+def build_candidates():
+    """Returns {name: unfitted Pipeline} for every vectorizer x classifier combination."""
+    vectorizers = {}
+    for ngram in [(1, 1), (1, 2)]:
+        tag = f"{ngram[0]}-{ngram[1]}gram"
+        vectorizers[f"count[{tag}]"] = lambda ngram=ngram: CountVectorizer(stop_words='english', ngram_range=ngram)
+        vectorizers[f"tfidf[{tag}]"] = lambda ngram=ngram: TfidfVectorizer(stop_words='english', ngram_range=ngram, sublinear_tf=True)
+        # alternate_sign=False keeps features non-negative so MultinomialNB can use them
+        vectorizers[f"hashing[{tag}]"] = lambda ngram=ngram: HashingVectorizer(stop_words='english', ngram_range=ngram,
+                                                                               n_features=2**18, alternate_sign=False)
+    classifiers = {
+        "nb": lambda: MultinomialNB(),
+        "logreg": lambda: LogisticRegression(max_iter=1000),
+        "linear_svm": lambda: LinearSVC(),
+    }
+    return {
+        f"{vec_name}+{clf_name}": Pipeline([('vectorizer', make_vec()), ('classifier', make_clf())])
+        for vec_name, make_vec in vectorizers.items()
+        for clf_name, make_clf in classifiers.items()
+    }
+
+def cross_validate_candidate(name, pipeline, X, y, cv):
+    """Mean cross-validated accuracy for one candidate (runs inside a joblib worker)."""
+    scores = cross_val_score(pipeline, X, y, cv=cv, scoring='accuracy')
+    return name, scores.mean(), scores.std()
+
+def benchmark_candidate(pipeline, X, batch_size=32, repeats=5):
+    """
+    Measures serialized size, load time and predict latency of a fitted pipeline.
+    Runs in the main process, one candidate at a time, so timings are not
+    skewed by the parallel cross-validation workers.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, 'candidate.joblib')
+        joblib.dump(pipeline, tmp_path)
+        size_kb = os.path.getsize(tmp_path) / 1024
+        load_times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            joblib.load(tmp_path)
+            load_times.append(time.perf_counter() - start)
+
+    texts = list(X)
+    pipeline.predict(texts[:1])  # warm-up
+
+    single_times = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            pipeline.predict([text])
+            single_times.append(time.perf_counter() - start)
+
+    batch = (texts * (batch_size // len(texts) + 1))[:batch_size]
+    batch_times = []
+    for _ in range(repeats * 4):
+        start = time.perf_counter()
+        pipeline.predict(batch)
+        batch_times.append(time.perf_counter() - start)
+
+    single_ms = np.array(single_times) * 1000
+    batch_ms = np.array(batch_times) * 1000
+    return {
+        'size_kb': size_kb,
+        'load_ms': min(load_times) * 1000,
+        'single_p50_ms': np.percentile(single_ms, 50),
+        'single_p99_ms': np.percentile(single_ms, 99),
+        f'batch{batch_size}_p50_ms': np.percentile(batch_ms, 50),
+        f'batch{batch_size}_p99_ms': np.percentile(batch_ms, 99),
+    }
+
+def run_model_selection(X, y, folds, n_jobs, latency_budget_ms, report_path=None):
+    """
+    Cross-validates every candidate in parallel, benchmarks each one, prints a
+    report and returns the most accurate pipeline (fitted on all data) whose
+    p99 single-letter latency fits the budget. Returns None if none fits.
+    """
+    candidates = build_candidates()
+    # StratifiedKFold cannot have more folds than examples in the smallest class
+    folds = max(2, min(folds, y.value_counts().min()))
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+    print(f"Cross-validating {len(candidates)} candidates with {folds}-fold CV (n_jobs={n_jobs})...")
+
+    cv_results = Parallel(n_jobs=n_jobs)(
+        delayed(cross_validate_candidate)(name, pipeline, X, y, cv)
+        for name, pipeline in candidates.items()
+    )
+
+    print("Benchmarking size and latency of each candidate...")
+    rows = []
+    fitted = {}
+    for name, mean_acc, std_acc in cv_results:
+        pipeline = candidates[name].fit(X, y)
+        fitted[name] = pipeline
+        rows.append({'candidate': name, 'cv_accuracy': mean_acc, 'cv_std': std_acc, **benchmark_candidate(pipeline, X)})
+
+    report = pd.DataFrame(rows).sort_values(['cv_accuracy', 'single_p99_ms'], ascending=[False, True])
+    report['within_budget'] = report['single_p99_ms'] <= latency_budget_ms
+    print("\nModel Selection Report:")
+    print(report.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    if report_path:
+        report.to_csv(report_path, index=False)
+        print(f"\nReport written to {report_path}")
+
+    eligible = report[report['within_budget']]
+    if eligible.empty:
+        print(f"\nError: No candidate meets the {latency_budget_ms} ms p99 latency budget. Nothing was saved.")
+        return None
+
+    best = eligible.iloc[0]
+    print(f"\nSelected '{best['candidate']}': CV accuracy {best['cv_accuracy'] * 100:.2f}%, "
+          f"p99 single-letter latency {best['single_p99_ms']:.3f} ms (budget {latency_budget_ms} ms)")
+    return fitted[best['candidate']]
+
 
 print("--- Starting Model Training ---")
 
@@ -31,6 +168,17 @@ if len(data) < 10:
 X = data['text']
 y = data['label']
 
+# --- Optional: Model Selection Mode ---
+if args.select:
+    model_pipeline = run_model_selection(X, y, args.cv, args.n_jobs, args.latency_budget_ms, args.report)
+    if model_pipeline is None:
+        exit()
+    joblib.dump(model_pipeline, model_path)
+    print(f"\n--- Success! ---")
+    print(f"Selected model saved successfully to: {model_path}")
+    print("You can now run 'mas_workflow.py'.")
+    exit()
+
 # --- 3. Split Data for Training and Testing ---
 # We'll use 80% for training and 20% for testing its accuracy
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
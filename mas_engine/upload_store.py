@@ -0,0 +1,233 @@
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import threading
+from dotenv import load_dotenv
+
+# --- Content-Addressed Upload Store + Derived-Artifact Cache ---
+# server.js keeps writing uploads as uploads/file-<timestamp>-<rand>.<ext> and
+# stores that path in letters.filePath. The engine ingests each upload into
+#
+#   uploads/.cas/objects/<sha256[:2]>/<sha256><ext>
+#
+# and the legacy path becomes a hard link to the object (a symlink if hard
+# links are not possible, a plain copy as last resort), so every existing
+# filePath still resolves and identical uploads share one copy on disk.
+# express.static does not serve dot-directories, so .cas stays private.
+#
+# Work derived from a file (rasterized pages, extracted text) is
+# cached per hash under uploads/.cas/derived/<sha256>/ and evicted least
+# recently used first once the cache exceeds UPLOAD_CACHE_MAX_MB.
+#
+# Configuration (.env):
+#   UPLOAD_STORE_DIR      store root (default: uploads/.cas)
+#   UPLOAD_CACHE_MAX_MB   size cap of the derived cache (default: 1024)
+#
+# Run manually:  python mas_engine/upload_store.py --migrate | --evict | --stats
+
+load_dotenv()
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PARENT_DIR = os.path.dirname(SCRIPT_DIR)
+UPLOADS_DIR = os.path.join(PARENT_DIR, 'uploads')
+STORE_DIR = os.getenv('UPLOAD_STORE_DIR') or os.path.join(UPLOADS_DIR, '.cas')
+OBJECTS_DIR = os.path.join(STORE_DIR, 'objects')
+DERIVED_DIR = os.path.join(STORE_DIR, 'derived')
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def content_hash(absolute_path):
+    """SHA-256 of a file, memoized on (path, size, mtime) so repeat calls are free."""
+    stat = os.stat(absolute_path)
+    key = (absolute_path, stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if key in _hash_memo:
+            return _hash_memo[key]
+    sha = hashlib.sha256()
+    with open(absolute_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    with _hash_lock:
+        _hash_memo[key] = digest
+    return digest
+
+def object_path(digest, ext):
+    return os.path.join(OBJECTS_DIR, digest[:2], digest + ext.lower())
+
+def _link_over(target, link_path):
+    """Atomically replaces link_path with a hard link (or symlink) to target. Returns the link kind."""
+    tmp_path = link_path + '.cas-tmp'
+    try:
+        os.link(target, tmp_path)
+        kind = 'hardlink'
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(target, os.path.dirname(link_path)), tmp_path)
+            kind = 'symlink'
+        except OSError:
+            return 'copy'
+    os.replace(tmp_path, link_path)
+    return kind
+
+
+def ingest(absolute_path):
+    """
+    Adds an upload to the store and returns (sha256, action). A new file is
+    hard-linked into objects/ (no copy); a duplicate of an existing object has
+    its legacy path replaced by a link to that object.
+    """
+    digest = content_hash(absolute_path)
+    target = object_path(digest, os.path.splitext(absolute_path)[1])
+    if os.path.exists(target):
+        if os.path.samefile(target, absolute_path):
+            return digest, 'present'
+        return digest, 'dedup-' + _link_over(target, absolute_path)
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(absolute_path, target)
+    except OSError:
+        shutil.copy2(absolute_path, target)
+    return digest, 'stored'
+
+
+class DerivedCache:
+    """
+    Per-hash cache of derived artifacts with LRU eviction under a size cap.
+    A file's mtime is its last use: get() touches it, evict() removes the
+    oldest files first.
+    """
+
+    def __init__(self, root=DERIVED_DIR, max_bytes=1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None  # computed lazily, then tracked on put()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_bytes=int(float(os.getenv('UPLOAD_CACHE_MAX_MB') or 1024) * 1024 * 1024))
+
+    def path(self, digest, name):
+        return os.path.join(self.root, digest, name)
+
+    def get(self, digest, name):
+        """Returns the cached file path (and marks it recently used), or None."""
+        cached = self.path(digest, name)
+        try:
+            os.utime(cached)
+        except OSError:
+            return None
+        return cached
+
+    def put_file(self, digest, name, write):
+        """Calls write(tmp_path) to produce the artifact, then publishes it atomically."""
+        cached = self.path(digest, name)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp_path = f"{cached}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, cached)
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(cached)
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self.evict()
+        return cached
+
+    def get_json(self, digest, name):
+        cached = self.get(digest, name)
+        if cached is None:
+            return None
+        with open(cached, encoding='utf-8') as f:
+            return json.load(f)
+
+    def put_json(self, digest, name, value):
+        def write(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+        return self.put_file(digest, name, write)
+
+    def get_image(self, digest, name):
+        from PIL import Image
+        cached = self.get(digest, name)
+        if cached is None:
+            return None
+        image = Image.open(cached)
+        image.load()  # don't keep the file open (eviction on Windows)
+        return image
+
+    def put_image(self, digest, name, image):
+        # Fastest zlib level: a 300 dpi page is only re-read locally, size matters less than encode time
+        return self.put_file(digest, name, lambda tmp_path: image.save(tmp_path, format='PNG', compress_level=1))
+
+    def evict(self):
+        """Deletes least recently used artifacts until the cache fits max_bytes."""
+        with self._lock:
+            entries = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith('.tmp'):
+                        continue  # being written by put_file()
+                    full = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(full)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, full))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, full in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(full)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass
+            self._size = total
+            return removed
+
+
+DERIVED_CACHE = DerivedCache.from_env()
+
+
+def migrate_uploads():
+    """Ingests every existing file in uploads/ (safe to re-run)."""
+    counts = {}
+    saved = 0
+    for name in sorted(os.listdir(UPLOADS_DIR)):
+        full = os.path.join(UPLOADS_DIR, name)
+        if not os.path.isfile(full) or os.path.islink(full) or name.endswith(('.cas-tmp', '.gz')):
+            continue
+        size = os.path.getsize(full)
+        digest, action = ingest(full)
+        counts[action] = counts.get(action, 0) + 1
+        if action in ('dedup-hardlink', 'dedup-symlink'):
+            saved += size
+        print(f"  {name}: {action} ({digest[:12]})")
+    print(f"[Upload Store] {counts}. Space reclaimed by dedup: {saved / 1024 / 1024:.2f} MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the content-addressed upload store")
+    parser.add_argument('--migrate', action='store_true', help="Ingest all existing uploads and dedupe them")
+    parser.add_argument('--evict', action='store_true', help="Enforce UPLOAD_CACHE_MAX_MB on the derived cache now")
+    parser.add_argument('--stats', action='store_true', help="Show store and cache sizes")
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_uploads()
+    if args.evict:
+        print(f"[Upload Store] Evicted {DERIVED_CACHE.evict()} cached artifact(s).")
+    if args.stats or not (args.migrate or args.evict):
+        for label, root in (('objects', OBJECTS_DIR), ('derived cache', DERIVED_DIR)):
+            files = [os.path.join(d, f) for d, _, fs in os.walk(root) for f in fs]
+            total = sum(os.path.getsize(f) for f in files)
+            print(f"[Upload Store] {label}: {len(files)} file(s), {total / 1024 / 1024:.2f} MiB ({root})")
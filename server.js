@@ -253,7 +253,7 @@ async function main() {
             // Step 3 - Part 2: Clerk confirms ML data and submits to pipeline
             // Update the letter with the Clerk's final data
             await db.run(
-                `UPDATE letters SET subject = ?, type = ?, amount = ?, status = ?, remarks = ?, stage = ? WHERE id = ?`,
+                `UPDATE letters SET subject = ?, type = ?, amount = ?, status = ?, remarks = ?, stage = ?, version = version + 1 WHERE id = ?`,
                 [subject, type, amount, 'Submitted', 'Clerk final submission', 'Clerk', id]
             );
             console.log(`\n--- MAS TRIGGERED: FINAL_SUBMISSION [ID: ${id}] ---`);